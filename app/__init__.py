@@ -1,23 +1,39 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+import click
 import os
 
 # Global extensions
 login_manager = LoginManager()
 db = SQLAlchemy()
 
+# Clave de desarrollo: con ella cualquiera puede firmar tokens, así que las
+# funciones que dependen de firmas (feed de calendario) quedan deshabilitadas.
+DEFAULT_SECRET_KEY = "dev-key"
+
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
 
     app.config.from_mapping(
-        SECRET_KEY=os.environ.get("SECRET_KEY", "dev-key"),
+        SECRET_KEY=os.environ.get("SECRET_KEY", DEFAULT_SECRET_KEY),
         SQLALCHEMY_DATABASE_URI=os.environ.get(
             "DATABASE_URL",
             f"sqlite:///{os.path.join(app.instance_path, 'carpool.db')}"
         ),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Monitoreo de rendimiento por request (ver app/perf.py)
+        PERF_MONITOR=os.environ.get("PERF_MONITOR") == "1",
+        PERF_SLOW_MS=float(os.environ.get("PERF_SLOW_MS", "500")),
+        PERF_SAMPLE_RATE=float(os.environ.get("PERF_SAMPLE_RATE", "0.05")),
+        PERF_WINDOW=int(os.environ.get("PERF_WINDOW", "500")),
+        # Procesos para optimizar grupos (zonas) en paralelo; 0 = uno por CPU.
+        # Por defecto 1: /optimize resuelve dentro del worker web, sin forks.
+        # El scheduler puede usar más con --workers.
+        OPTIMIZE_WORKERS=int(os.environ.get("OPTIMIZE_WORKERS", "1")),
+        # Segundos que la API reutiliza la semana actual sin consultar la BD
+        API_VERSION_TTL=float(os.environ.get("API_VERSION_TTL", "5")),
     )
 
     # Ensure instance folder exists
@@ -30,18 +46,52 @@ def create_app(test_config=None):
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
 
+    from . import perf
+    perf.init_app(app)
+
     from .models import User  # noqa: F401
 
     # Blueprints
     from .auth import bp as auth_bp
     from .main import bp as main_bp
     from .admin import bp as admin_bp
+    from .api import bp as api_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp, url_prefix="/admin")
+    app.register_blueprint(api_bp, url_prefix="/api/v1")
 
-    with app.app_context():
-        db.create_all()
+    @app.cli.command("init-db")
+    def init_db_command():
+        init_db()
+        click.echo("Base de datos inicializada")
 
     return app
+
+
+def add_missing_columns():
+    """
+    Agrega a las tablas existentes las columnas nuevas del modelo (SQLite no
+    tiene migraciones; basta con ADD COLUMN para columnas nullable). Solo se
+    llama desde init_db, nunca al arrancar un worker. Requiere app context.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in existing:
+                ddl = col.type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {ddl}'))
+    db.session.commit()
+
+
+def init_db():
+    """Crea las tablas faltantes y agrega columnas nuevas. Requiere app context."""
+    db.create_all()
+    add_missing_columns()
@@ -1,9 +1,14 @@
 
-from flask import Blueprint, render_template, redirect, url_for, request, flash
-from flask_login import login_required, current_user
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
+from flask_login import login_required, current_user, logout_user
 from datetime import date, timedelta
-from .models import db, User, Preference, DAYS, IDA_SLOTS, VUELTA_SLOTS, Week
-from .main import monday_of_week
+from .models import (
+    db, User, Preference, DAYS, IDA_SLOTS, VUELTA_SLOTS, Week, get_or_create_week, monday_of_week,
+    invalidate_user, normalize_grupo,
+)
+from .analytics import week_metrics, archive_metrics
+from .api import invalidate_payload
+from . import perf
 
 bp = Blueprint("admin", __name__)
 
@@ -11,7 +16,14 @@ bp = Blueprint("admin", __name__)
 @bp.before_request
 def check_admin():
     if request.endpoint and request.endpoint.startswith("admin."):
-        if not current_user.is_authenticated or not current_user.is_admin:
+        if not current_user.is_authenticated:
+            return redirect(url_for("auth.login"))
+        # El SessionUser cacheado puede estar desactualizado: is_admin se lee del User real
+        user = db.session.get(User, current_user.id)
+        if user is None or not user.is_admin:
+            invalidate_user(current_user.id)
+            if user is None:
+                logout_user()
             return redirect(url_for("auth.login"))
 
 
@@ -23,12 +35,36 @@ def dashboard():
     return render_template("admin_dashboard.html", users=users, days=DAYS, ida=IDA_SLOTS, vuelta=VUELTA_SLOTS, weeks=weeks)
 
 
+@bp.route("/analytics")
+@login_required
+def analytics():
+    weeks = Week.query.order_by(Week.start_date.desc()).all()
+    week_id = request.args.get("week_id", type=int)
+    if week_id is None:
+        week_id = get_or_create_week(monday_of_week(date.today())).id
+    return render_template(
+        "admin_analytics.html",
+        weeks=weeks,
+        week_id=week_id,
+        metrics=week_metrics(week_id),
+        archive=archive_metrics(),
+    )
+
+
+@bp.route("/perf.json")
+@login_required
+def perf_summary():
+    return jsonify(perf.summary())
+
+
 @bp.post("/user/<int:user_id>/delete")
 @login_required
 def delete_user(user_id: int):
     u = User.query.get_or_404(user_id)
     db.session.delete(u)
     db.session.commit()
+    invalidate_user(user_id)
+    invalidate_payload()
     flash("Usuario eliminado", "success")
     return redirect(url_for("admin.dashboard"))
 
@@ -69,6 +105,7 @@ def edit_user(user_id: int):
             u.name = user_name
         
         u.volunteer_second_day = bool(request.form.get("global_volunteer"))
+        u.grupo = normalize_grupo(request.form.get("grupo"))
         for d in DAYS:
             ida = request.form.get(f"{d}_ida") or None
             vuelta = request.form.get(f"{d}_vuelta") or None
@@ -85,6 +122,8 @@ def edit_user(user_id: int):
             pref.flex_vuelta = flex_vuelta
             pref.can_drive = can_drive
         db.session.commit()
+        invalidate_user(u.id)
+        invalidate_payload()
         flash("Preferencias actualizadas", "success")
         return redirect(url_for("admin.dashboard"))
     prefs = {p.day: p for p in Preference.query.filter_by(user_id=u.id, week_id=week.id).all()}
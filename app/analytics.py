@@ -0,0 +1,132 @@
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, case, func, or_
+from .models import db, Preference, Week, DAYS, IDA_SLOTS, VUELTA_SLOTS, CAR_CAPACITY
+
+# Resultados cacheados por alcance ("archive" o week_id) junto a su versión.
+# La versión cambia cuando cambia cualquier Preference del alcance, así que no
+# hace falta invalidar a mano.
+_cache: Dict[object, tuple] = {}
+
+
+def _cached(scope, version, compute):
+    hit = _cache.get(scope)
+    if hit and hit[0] == version:
+        return hit[1]
+    result = compute()
+    _cache[scope] = (version, result)
+    return result
+
+
+def _flag(cond):
+    return func.coalesce(func.sum(case((cond, 1), else_=0)), 0)
+
+
+def _users(cond):
+    return func.count(func.distinct(case((cond, Preference.user_id))))
+
+
+def _movido(tipo: str):
+    """Pasajero flexible que quedó en un horario distinto al pedido."""
+    if tipo == "ida":
+        return and_(Preference.role_ida == "pasajero", Preference.flex_ida.is_(True),
+                    Preference.assigned_ida_slot != Preference.ida_slot)
+    return and_(Preference.role_vuelta == "pasajero", Preference.flex_vuelta.is_(True),
+                Preference.assigned_vuelta_slot != Preference.vuelta_slot)
+
+
+def data_version(week_id: Optional[int] = None) -> Tuple[int, Optional[str]]:
+    """Versión barata de los datos: (n° de preferencias, última modificación)."""
+    q = db.session.query(func.count(Preference.id), func.max(Preference.updated_at))
+    if week_id is not None:
+        q = q.filter(Preference.week_id == week_id)
+    count, last = q.one()
+    return count, last.isoformat() if last else None
+
+
+def _turno_rows(week_id: int, tipo: str):
+    slot = Preference.assigned_ida_slot if tipo == "ida" else Preference.assigned_vuelta_slot
+    role = Preference.role_ida if tipo == "ida" else Preference.role_vuelta
+    return (
+        db.session.query(
+            Preference.day,
+            slot,
+            func.count(Preference.id),
+            _flag(role == "conductor"),
+            _flag(role == "pasajero"),
+            _users(_movido(tipo)),
+        )
+        .filter(Preference.week_id == week_id, slot.isnot(None))
+        .group_by(Preference.day, slot)
+        .all()
+    )
+
+
+def _week_metrics(week_id: int) -> dict:
+    turnos = []
+    for tipo, slots in (("ida", IDA_SLOTS), ("vuelta", VUELTA_SLOTS)):
+        rows = {(d, s): r for d, s, *r in _turno_rows(week_id, tipo)}
+        for d in DAYS:
+            for s in slots:
+                total, conductores, pasajeros, movidos = rows.get((d, s), (0, 0, 0, 0))
+                n_t = (total + CAR_CAPACITY - 1) // CAR_CAPACITY
+                turnos.append({
+                    "day": d,
+                    "slot": s,
+                    "tipo": tipo,
+                    "total": total,
+                    "conductores": conductores,
+                    "pasajeros": pasajeros,
+                    "movidos": movidos,
+                    "N_t": n_t,
+                    "pasajeros_por_auto": round(pasajeros / conductores, 2) if conductores else None,
+                    "utilizacion": round((conductores + pasajeros) / (conductores * CAR_CAPACITY), 2)
+                    if conductores else None,
+                })
+    return {"week_id": week_id, "turnos": turnos}
+
+
+def _archive_metrics() -> List[dict]:
+    rows = (
+        db.session.query(
+            Week.id,
+            Week.start_date,
+            func.count(func.distinct(Preference.user_id)),
+            _flag(Preference.assigned_ida_slot.isnot(None)) + _flag(Preference.assigned_vuelta_slot.isnot(None)),
+            _flag(Preference.role_ida == "conductor") + _flag(Preference.role_vuelta == "conductor"),
+            _flag(Preference.role_ida == "pasajero") + _flag(Preference.role_vuelta == "pasajero"),
+            _users(or_(_movido("ida"), _movido("vuelta"))),
+        )
+        .join(Preference, Preference.week_id == Week.id)
+        .group_by(Week.id, Week.start_date)
+        .order_by(Week.start_date)
+        .all()
+    )
+    semanas = []
+    for week_id, start_date, usuarios, viajes, conductores, pasajeros, movidos in rows:
+        semanas.append({
+            "week_id": week_id,
+            "start_date": start_date.isoformat(),
+            "usuarios": usuarios,
+            "viajes": viajes,
+            "conductores": conductores,
+            "pasajeros": pasajeros,
+            "movidos": movidos,
+            "pasajeros_por_auto": round(pasajeros / conductores, 2) if conductores else None,
+            "utilizacion": round((conductores + pasajeros) / (conductores * CAR_CAPACITY), 2)
+            if conductores else None,
+        })
+    return semanas
+
+
+def week_metrics(week_id: int) -> dict:
+    """
+    Métricas de ocupación por turno de una semana: conductores vs N_t,
+    pasajeros por auto y pasajeros movidos por flexibilidad.
+    """
+    return _cached(week_id, data_version(week_id), lambda: _week_metrics(week_id))
+
+
+def archive_metrics() -> List[dict]:
+    """Resumen por semana de todas las semanas guardadas (tendencias)."""
+    version = (data_version(), Week.query.count())
+    return _cached("archive", version, _archive_metrics)
@@ -0,0 +1,293 @@
+"""
+API de solo lectura (v1): horario de la semana actual en JSON y feed iCalendar
+por usuario. El feed se autentica con un token firmado que incluye un secreto
+revocable por usuario (User.calendar_token). Todas las respuestas salen de un payload precomputado por semana
+(cacheado por versión de datos) con ETag fuerte, así que un cliente que hace
+polling con If-None-Match recibe 304 sin reconstruir nada. El payload de la
+semana actual se reutiliza sin consultar la BD durante API_VERSION_TTL
+segundos; los commits de este proceso lo invalidan con invalidate_payload() y
+el TTL acota lo que puede quedar desactualizado en otros procesos.
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, Response, abort, current_app, request, url_for
+from flask_login import current_user, login_required
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import func
+
+from . import DEFAULT_SECRET_KEY
+from .analytics import data_version
+from .models import (
+    db, CarAssignment, Preference, User, DAYS, IDA_SLOTS, VUELTA_SLOTS, get_or_create_week, monday_of_week,
+)
+
+bp = Blueprint("api", __name__)
+
+_lock = threading.Lock()
+_payloads = {}  # week_id -> (version, payload)
+_current = None  # (lunes, expira, payload) de la semana actual
+
+
+def _version(week_id: int):
+    cars = db.session.query(func.count(CarAssignment.id), func.max(CarAssignment.id)) \
+        .filter(CarAssignment.week_id == week_id).one()
+    users = db.session.query(func.count(User.id), func.max(User.updated_at)).one()
+    return data_version(week_id), tuple(cars), tuple(users)
+
+
+def _build_payload(week) -> dict:
+    users, tokens = {}, {}
+    for uid, name, token in db.session.query(User.id, User.name, User.calendar_token):
+        users[uid] = name
+        tokens[uid] = token
+    car_of = {
+        (c.day, c.tipo, c.passenger_id): c.driver_id
+        for c in CarAssignment.query.filter_by(week_id=week.id).all()
+    }
+    grid = {
+        "ida": {d: {s: {} for s in IDA_SLOTS} for d in DAYS},
+        "vuelta": {d: {s: {} for s in VUELTA_SLOTS} for d in DAYS},
+    }
+    mine = {}
+    for p in Preference.query.filter_by(week_id=week.id).order_by(Preference.user_id).all():
+        for tipo, pedido, slot, role in (
+            ("ida", p.ida_slot, p.assigned_ida_slot, p.role_ida),
+            ("vuelta", p.vuelta_slot, p.assigned_vuelta_slot, p.role_vuelta),
+        ):
+            if not (pedido or slot):
+                continue
+            driver_id = p.user_id if role == "conductor" else car_of.get((p.day, tipo, p.user_id))
+            mine.setdefault(p.user_id, []).append({
+                "day": p.day,
+                "tipo": tipo,
+                "requested_slot": pedido,
+                "assigned_slot": slot,
+                "role": role,
+                "driver_id": driver_id,
+            })
+            if not slot:
+                continue
+            car = grid[tipo][p.day][slot].setdefault(driver_id, {"conductor": None, "pasajeros": []})
+            person = {"id": p.user_id, "name": users.get(p.user_id, str(p.user_id))}
+            if role == "conductor":
+                car["conductor"] = person
+            else:
+                car["pasajeros"].append(person)
+
+    for items in mine.values():
+        items.sort(key=lambda a: (DAYS.index(a["day"]), a["tipo"] != "ida"))
+
+    # Autos primero; pasajeros sin auto al final
+    for tipo in grid:
+        for d in grid[tipo]:
+            for s, cell in grid[tipo][d].items():
+                grid[tipo][d][s] = sorted(cell.values(), key=lambda car: car["conductor"] is None)
+
+    return {
+        "week": {"id": week.id, "start_date": week.start_date},
+        "grid": grid,
+        "assignments": mine,
+        "users": users,
+        "tokens": tokens,  # User.calendar_token; rotarlo cambia User.updated_at y la versión
+        "bodies": {},  # cache de respuestas serializadas: key -> (bytes, etag)
+    }
+
+
+def week_payload(week) -> dict:
+    version = _version(week.id)
+    with _lock:
+        hit = _payloads.get(week.id)
+        if hit and hit[0] == version:
+            return hit[1]
+    payload = _build_payload(week)
+    with _lock:
+        _payloads.clear()  # solo interesa la versión vigente
+        _payloads[week.id] = (version, payload)
+    return payload
+
+
+def _serve(payload, key, render, mimetype):
+    """Serializa una vez por versión y responde con ETag fuerte / 304."""
+    hit = payload["bodies"].get(key)
+    if hit is None:
+        body = render()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        hit = (body, hashlib.sha256(body).hexdigest()[:32])
+        payload["bodies"][key] = hit
+    body, etag = hit
+    resp = Response(body, mimetype=mimetype)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
+
+
+def _json(data) -> str:
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _week_json(payload) -> dict:
+    return {"id": payload["week"]["id"], "start_date": payload["week"]["start_date"].isoformat()}
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="calendar-feed")
+
+
+def feed_enabled() -> bool:
+    # Con la clave por defecto los tokens se pueden falsificar
+    return current_app.config["SECRET_KEY"] != DEFAULT_SECRET_KEY
+
+
+def calendar_url(user_id: int, token: "str | None" = None) -> "str | None":
+    """
+    URL del feed de un usuario, o None si el feed está deshabilitado. Si no se
+    pasa el token (o el usuario aún no tiene), se lee de la BD y se genera.
+    """
+    if not feed_enabled():
+        return None
+    if token is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        if not user.calendar_token:
+            user.rotate_calendar_token()
+            db.session.commit()
+            invalidate_payload()
+        token = user.calendar_token
+    return url_for("api.calendar", token=_serializer().dumps([user_id, token]), _external=True)
+
+
+def invalidate_payload():
+    """Fuerza a revisar la versión en el próximo request. Llamar tras commits que cambian datos."""
+    global _current
+    with _lock:
+        _current = None
+
+
+def _current_payload():
+    global _current
+    monday = monday_of_week(date.today())
+    now = time.monotonic()
+    with _lock:
+        if _current and _current[0] == monday and _current[1] > now:
+            return _current[2]
+    payload = week_payload(get_or_create_week(monday))
+    with _lock:
+        _current = (monday, now + current_app.config["API_VERSION_TTL"], payload)
+    return payload
+
+
+@bp.get("/week")
+@login_required
+def week_grid():
+    payload = _current_payload()
+    return _serve(payload, "week", lambda: _json({
+        "week": _week_json(payload),
+        "ida": payload["grid"]["ida"],
+        "vuelta": payload["grid"]["vuelta"],
+    }), "application/json")
+
+
+@bp.get("/me")
+@login_required
+def my_assignments():
+    payload = _current_payload()
+    uid = current_user.id
+    token = payload["tokens"].get(uid)
+    return _serve(payload, ("me", uid, request.host), lambda: _json({
+        "week": _week_json(payload),
+        "user": {"id": uid, "name": payload["users"].get(uid)},
+        "assignments": payload["assignments"].get(uid, []),
+        "calendar_url": calendar_url(uid, token),
+    }), "application/json")
+
+
+def _ics_text(value: str) -> str:
+    """Escapa un valor TEXT según RFC 5545 (3.3.11)."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _ics_fold(line: str) -> str:
+    """Pliega líneas de más de 75 octetos (RFC 5545 3.1) sin cortar caracteres UTF-8."""
+    out, current, size = [], "", 0
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        # Las líneas de continuación empiezan con un espacio, que cuenta en el límite
+        if size + n > 75:
+            out.append(current)
+            current, size = " ", 1
+        current += ch
+        size += n
+    out.append(current)
+    return "\r\n".join(out)
+
+
+def _ics(payload, uid: int) -> str:
+    start_date = payload["week"]["start_date"]
+    stamp = start_date.strftime("%Y%m%dT000000Z")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//CarpoolPA//Horario//ES",
+        "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:Carpool",
+    ]
+    for a in payload["assignments"].get(uid, []):
+        if not a["assigned_slot"]:
+            continue
+        day = start_date + timedelta(days=DAYS.index(a["day"]))
+        h, m = (int(x) for x in a["assigned_slot"].split(":"))
+        start = datetime(day.year, day.month, day.day, h, m)
+        role = a["role"] or "sin rol"
+        summary = f"Carpool {a['tipo']} ({role})"
+        car = next(
+            (c for c in payload["grid"][a["tipo"]][a["day"]][a["assigned_slot"]]
+             if c["conductor"] and c["conductor"]["id"] == a["driver_id"]),
+            None,
+        )
+        detail = ""
+        if car:
+            pasajeros = ", ".join(p["name"] for p in car["pasajeros"])
+            detail = f"Conductor: {car['conductor']['name']}\nPasajeros: {pasajeros or '-'}"
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{start_date.isoformat()}-{a['day']}-{a['tipo']}-{uid}@carpoolpa",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{start.strftime('%Y%m%dT%H%M%S')}",
+            "DURATION:PT30M",
+            f"SUMMARY:{_ics_text(summary)}",
+            f"DESCRIPTION:{_ics_text(detail)}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_ics_fold(line) for line in lines) + "\r\n"
+
+
+@bp.get("/calendar/<token>.ics")
+def calendar(token: str):
+    # Sin sesión: los clientes de calendario se autentican con el token firmado
+    if not feed_enabled():
+        abort(404)
+    try:
+        uid, secret = _serializer().loads(token)
+        uid, secret = int(uid), str(secret)
+    except (BadSignature, ValueError, TypeError):
+        abort(404)
+    payload = _current_payload()
+    expected = payload["tokens"].get(uid)
+    if not expected or not hmac.compare_digest(expected, secret):
+        abort(404)
+    return _serve(payload, ("ics", uid), lambda: _ics(payload, uid), "text/calendar")
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from .models import User
+from .models import User, invalidate_user
+from .api import invalidate_payload
 from . import db
 import os
 
@@ -23,6 +24,7 @@ def register():
         u.set_password(password)
         db.session.add(u)
         db.session.commit()
+        invalidate_payload()
         flash("Cuenta creada, ahora inicia sesión", "success")
         return redirect(url_for("auth.login"))
     return render_template("register.html")
@@ -57,6 +59,7 @@ def make_admin():
         if u:
             u.is_admin = True
             db.session.commit()
+            invalidate_user(u.id)
             return "Admin granted to first user"
         return "No users"
     return "Forbidden", 403
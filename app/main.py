@@ -1,58 +1,64 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash
-from flask_login import login_required, current_user
-from datetime import date, timedelta
-from .models import db, DAYS, IDA_SLOTS, VUELTA_SLOTS, Preference, get_or_create_week, User
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask_login import login_required, current_user, logout_user
+from datetime import date
+from .models import (
+    db, DAYS, IDA_SLOTS, VUELTA_SLOTS, Preference, CarAssignment, get_or_create_week, monday_of_week, User,
+    invalidate_user, normalize_grupo,
+)
 from .forms import PreferenceForm
 from .services import build_usuarios_from_db, build_conductores_from_db, persist_assignments
-from .optimizers import modelo_densidad, modelo_conductores, fill_pasajeros
+from .api import calendar_url, invalidate_payload
 
 bp = Blueprint("main", __name__)
 
 
-def monday_of_week(dt: date) -> date:
-    return dt - timedelta(days=dt.weekday())
-
-
-def next_week_monday(dt: date) -> date:
-    return monday_of_week(dt) + timedelta(days=7)
-
-
 @bp.route("/")
 @login_required
 def index():
     # Horario Actual (solo semana actual)
     cur_mon = monday_of_week(date.today())
     cur_week = get_or_create_week(cur_mon)
-    # Build assignment grids for all users
+    # Build assignment grids for all users, grouped by car:
+    # grid[d][s] = [{"conductor": label|None, "pasajeros": [labels]}]
     def build_grid(week_id: int):
-        grid_ida = {d: {s: [] for s in IDA_SLOTS} for d in DAYS}
-        grid_vuelta = {d: {s: [] for s in VUELTA_SLOTS} for d in DAYS}
+        cells = {
+            "ida": {d: {s: {} for s in IDA_SLOTS} for d in DAYS},
+            "vuelta": {d: {s: {} for s in VUELTA_SLOTS} for d in DAYS},
+        }
         prefs = Preference.query.filter_by(week_id=week_id).all()
         users = {u.id: u for u in User.query.all()}
-        
+        car_of = {
+            (c.day, c.slot, c.tipo, c.passenger_id): c.driver_id
+            for c in CarAssignment.query.filter_by(week_id=week_id).all()
+        }
+
+        def place(p, name, tipo, slot, role):
+            cell = cells[tipo][p.day][slot]
+            if role == "conductor":
+                car = cell.setdefault(p.user_id, {"conductor": None, "pasajeros": []})
+                car["conductor"] = f"🚗 {name}"
+                return
+            label = f"👤 {name}" if role == "pasajero" else f"❓ {name}"
+            driver_id = car_of.get((p.day, slot, tipo, p.user_id))
+            car = cell.setdefault(driver_id, {"conductor": None, "pasajeros": []})
+            car["pasajeros"].append(label)
+
         for p in prefs:
             user = users.get(p.user_id)
             name = user.name if user else str(p.user_id)
-            
             if p.assigned_ida_slot:
-                if p.role_ida == "conductor":
-                    label = f"🚗 {name}"
-                elif p.role_ida == "pasajero":
-                    label = f"👤 {name}"
-                else:
-                    label = f"❓ {name}"
-                grid_ida[p.day][p.assigned_ida_slot].append(label)
-                
+                place(p, name, "ida", p.assigned_ida_slot, p.role_ida)
             if p.assigned_vuelta_slot:
-                if p.role_vuelta == "conductor":
-                    label = f"🚗 {name}"
-                elif p.role_vuelta == "pasajero":
-                    label = f"👤 {name}"
-                else:
-                    label = f"❓ {name}"
-                grid_vuelta[p.day][p.assigned_vuelta_slot].append(label)
-                
-        return grid_ida, grid_vuelta
+                place(p, name, "vuelta", p.assigned_vuelta_slot, p.role_vuelta)
+
+        def as_lists(grid):
+            # Autos primero; pasajeros sin auto al final
+            return {
+                d: {s: sorted(cell.values(), key=lambda car: car["conductor"] is None) for s, cell in slots.items()}
+                for d, slots in grid.items()
+            }
+
+        return as_lists(cells["ida"]), as_lists(cells["vuelta"])
 
     grid_ida, grid_vuelta = build_grid(cur_week.id)
 
@@ -76,7 +82,15 @@ def usuario():
 
     if request.method == "POST":
         # Global volunteer flag
-        current_user.volunteer_second_day = bool(request.form.get("global_volunteer"))
+        user = db.session.get(User, current_user.id)
+        if user is None:
+            # Eliminado desde otro worker mientras su identidad seguía en cache
+            invalidate_user(current_user.id)
+            logout_user()
+            flash("Tu cuenta ya no existe", "warning")
+            return redirect(url_for("auth.login"))
+        user.volunteer_second_day = bool(request.form.get("global_volunteer"))
+        user.grupo = normalize_grupo(request.form.get("grupo"))
         any_can_drive = False
         for d in DAYS:
             ida = request.form.get(f"{d}_ida") or None
@@ -103,21 +117,51 @@ def usuario():
             flash("Debes marcar al menos un día en que puedes conducir.", "danger")
             return redirect(url_for("main.usuario"))
         db.session.commit()
+        invalidate_user(user.id)
+        invalidate_payload()
         flash("Preferencias guardadas", "success")
         return redirect(url_for("main.usuario"))
 
     # GET: build current prefs
     prefs = {p.day: p for p in Preference.query.filter_by(user_id=current_user.id, week_id=week.id).all()}
-    return render_template("usuario.html", days=DAYS, ida=IDA_SLOTS, vuelta=VUELTA_SLOTS, prefs=prefs)
+    return render_template("usuario.html", days=DAYS, ida=IDA_SLOTS, vuelta=VUELTA_SLOTS, prefs=prefs,
+                           calendar_url=calendar_url(current_user.id))
+
+
+@bp.post("/usuario/calendario")
+@login_required
+def reset_calendar():
+    user = db.session.get(User, current_user.id)
+    if user is None:
+        invalidate_user(current_user.id)
+        logout_user()
+        flash("Tu cuenta ya no existe", "warning")
+        return redirect(url_for("auth.login"))
+    user.rotate_calendar_token()
+    db.session.commit()
+    invalidate_payload()
+    flash("Nuevo enlace de calendario generado; el anterior dejó de funcionar", "success")
+    return redirect(url_for("main.usuario"))
 
 
 @bp.route("/optimize")
 @login_required
 def optimize_when():
-    if not current_user.is_admin:
+    # is_admin del User real, no del SessionUser cacheado (puede venir de otro worker)
+    user = db.session.get(User, current_user.id)
+    if user is None:
+        invalidate_user(current_user.id)
+        logout_user()
+        flash("Tu cuenta ya no existe", "warning")
+        return redirect(url_for("auth.login"))
+    if not user.is_admin:
+        invalidate_user(user.id)
         flash("Solo admin", "danger")
         return redirect(url_for("main.index"))
 
+    # Import diferido: PuLP solo se carga en el proceso que optimiza
+    from .optimizers import optimize_sharded
+
     mon = monday_of_week(date.today())
     week = get_or_create_week(mon)
 
@@ -126,20 +170,22 @@ def optimize_when():
         flash("No hay usuarios para optimizar", "warning")
         return redirect(url_for("main.index"))
 
-    y, status1 = modelo_densidad(usuarios)
+    # Cada grupo (zona) se resuelve por separado y los resultados se unen
+    conductores = build_conductores_from_db(week.id, usuarios)
+    y, x, pasajeros, autos, sin_auto, status1, status2 = optimize_sharded(
+        usuarios, conductores, workers=current_app.config["OPTIMIZE_WORKERS"],
+    )
     if status1 != "Optimal":
         flash(f"Densidad no óptima: {status1}", "danger")
         return redirect(url_for("main.index"))
-
-    conductores = build_conductores_from_db(week.id, usuarios)
-    x, N_t, D_t, status2 = modelo_conductores(conductores, y)
     if status2 != "Optimal":
         flash(f"Conductores no óptimo: {status2}", "danger")
         return redirect(url_for("main.index"))
 
-    pasajeros = fill_pasajeros(y, x)
-
-    persist_assignments(week.id, y, x, pasajeros)
+    persist_assignments(week.id, y, x, pasajeros, autos)
 
-    flash("Optimización completada", "success")
+    if sin_auto:
+        flash(f"Optimización completada; {sin_auto} viaje(s) de pasajeros quedaron sin auto", "warning")
+    else:
+        flash("Optimización completada", "success")
     return redirect(url_for("main.index"))
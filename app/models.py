@@ -1,4 +1,8 @@
-from datetime import datetime, date
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+import secrets
+import threading
+import time
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from . import db, login_manager
@@ -7,6 +11,7 @@ from . import db, login_manager
 DAYS = ["lunes", "martes", "miercoles", "jueves", "viernes"]
 IDA_SLOTS = ["8:20", "9:40", "11:00", "12:20"]
 VUELTA_SLOTS = ["13:30", "16:00", "17:20", "18:40"]
+CAR_CAPACITY = 4  # personas por auto (incluye al conductor)
 
 
 class User(UserMixin, db.Model):
@@ -16,7 +21,10 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     volunteer_second_day = db.Column(db.Boolean, default=False)
+    grupo = db.Column(db.String(64), nullable=True)  # zona/campus de salida; separa la optimización
+    calendar_token = db.Column(db.String(64), nullable=True)  # secreto del feed iCalendar; rotarlo lo revoca
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     preferences = db.relationship("Preference", backref="user", cascade="all, delete-orphan")
 
@@ -26,16 +34,73 @@ class User(UserMixin, db.Model):
     def check_password(self, password: str) -> bool:
         return check_password_hash(self.password_hash, password)
 
+    def rotate_calendar_token(self):
+        self.calendar_token = secrets.token_urlsafe(24)
+
+
+def normalize_grupo(value) -> "str | None":
+    """Zona comparable: sin mayúsculas y con espacios colapsados ("  Las  Condes" -> "las condes")."""
+    value = " ".join((value or "").split()).casefold()
+    return value or None
+
+
+class SessionUser(UserMixin):
+    """
+    Identidad del usuario autenticado, sin sesión de BD (lo que entrega load_user).
+    Para modificar el usuario hay que cargar el User real con db.session.get.
+    """
+
+    def __init__(self, user: User):
+        self.id = user.id
+        self.name = user.name
+        self.is_admin = bool(user.is_admin)
+        self.volunteer_second_day = bool(user.volunteer_second_day)
+        self.grupo = user.grupo
+
+
+# Cache por proceso de SessionUser: user_id -> (expira, SessionUser), en orden LRU.
+# Se invalida al editar/eliminar un usuario; el TTL acota lo que puede quedar
+# desactualizado en otros workers.
+USER_CACHE_TTL = 60.0
+USER_CACHE_SIZE = 1024
+_user_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+
+def invalidate_user(user_id: int):
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(user_id)
+        if hit and hit[0] > now:
+            _user_cache.move_to_end(user_id)
+            return hit[1]
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        invalidate_user(user_id)
+        return None
+    identity = SessionUser(user)
+    with _user_cache_lock:
+        _user_cache[user_id] = (now + USER_CACHE_TTL, identity)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return identity
 
 
 class Week(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     start_date = db.Column(db.Date, nullable=False, unique=True)  # Monday
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Marca de datos (services.week_watermark) de la última optimización persistida
+    optimized_version = db.Column(db.String(128), nullable=True)
 
 
 class Preference(db.Model):
@@ -59,6 +124,8 @@ class Preference(db.Model):
     assigned_ida_slot = db.Column(db.String(16), nullable=True)
     assigned_vuelta_slot = db.Column(db.String(16), nullable=True)
 
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
     week = db.relationship("Week", backref=db.backref("preferences", cascade="all, delete-orphan"))
 
     __table_args__ = (
@@ -66,6 +133,39 @@ class Preference(db.Model):
     )
 
 
+class CarAssignment(db.Model):
+    """Pasajero asignado al auto de un conductor en un turno."""
+    id = db.Column(db.Integer, primary_key=True)
+    week_id = db.Column(db.Integer, db.ForeignKey("week.id"), nullable=False)
+    day = db.Column(db.String(16), nullable=False)
+    slot = db.Column(db.String(16), nullable=False)
+    tipo = db.Column(db.String(8), nullable=False)  # ida/vuelta
+    driver_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    passenger_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+
+    week = db.relationship("Week", backref=db.backref("car_assignments", cascade="all, delete-orphan"))
+    driver = db.relationship(
+        "User", foreign_keys=[driver_id],
+        backref=db.backref("cars_driven", cascade="all, delete-orphan"),
+    )
+    passenger = db.relationship(
+        "User", foreign_keys=[passenger_id],
+        backref=db.backref("cars_ridden", cascade="all, delete-orphan"),
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint("week_id", "day", "tipo", "passenger_id", name="uq_week_turno_passenger"),
+    )
+
+
+def monday_of_week(dt: date) -> date:
+    return dt - timedelta(days=dt.weekday())
+
+
+def next_week_monday(dt: date) -> date:
+    return monday_of_week(dt) + timedelta(days=7)
+
+
 def get_or_create_week(monday_date: date) -> Week:
     week = Week.query.filter_by(start_date=monday_date).first()
     if not week:
@@ -1,7 +1,10 @@
-from collections import defaultdict
-from typing import Dict, List, Tuple
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import heapq
+import os
 import pulp as pl
-from .models import DAYS, IDA_SLOTS, VUELTA_SLOTS
+from .models import DAYS, IDA_SLOTS, VUELTA_SLOTS, CAR_CAPACITY
 
 Turno = Tuple[str, str, str]  # (day, slot, tipo)
 
@@ -101,7 +104,7 @@ def modelo_conductores(conductores: List[dict], demanda_opt: Dict[int, Dict[Turn
         for t, v in tu.items():
             if v:
                 demand_t[t] += 1
-    capacidad = 4
+    capacidad = CAR_CAPACITY
     N_t = {t: (demand_t[t] + capacidad - 1) // capacidad for t in turnos}
 
     prob = pl.LpProblem("Modelo_Conductores", pl.LpMaximize)
@@ -173,3 +176,151 @@ def fill_pasajeros(demanda_opt: Dict[int, Dict[Turno, int]], conductores_asignad
                 if (uid, t) not in conductor_turnos:
                     pasajeros[uid][t] = 1
     return pasajeros
+
+
+def match_pasajeros(conductores_asignados: Dict[int, Dict[Turno, int]], pasajeros: Dict[int, Dict[Turno, int]],
+                    capacidad: int = CAR_CAPACITY):
+    """
+    Asigna cada pasajero al auto de un conductor del mismo turno (capacidad - 1 asientos).
+    Recorre los turnos en orden (día, ida, vuelta) para mantener grupos estables
+    entre ida/vuelta y entre días:
+    1. cada pasajero intenta repetir su último conductor;
+    2. los que no pueden se agrupan por el auto en que viajaron la última vez y cada
+       grupo (el más grande primero) va junto al auto con más asientos libres,
+       partiéndose solo si no cabe;
+    3. el resto se reparte por turnos rotativos.
+    Por los ordenamientos y el heap es O(n log n) por turno.
+    Return (autos[t][conductor] = [pasajeros], sin_auto[t] = [pasajeros])
+    """
+    asientos = capacidad - 1
+    conductores_t = defaultdict(list)
+    for uid, tu in conductores_asignados.items():
+        for t, v in tu.items():
+            if v:
+                conductores_t[t].append(uid)
+    pasajeros_t = defaultdict(list)
+    for uid, tu in pasajeros.items():
+        for t, v in tu.items():
+            if v:
+                pasajeros_t[t].append(uid)
+
+    ultimo_conductor = {}
+    ultimo_auto = {}  # uid -> (turno, conductor) del último auto en que viajó
+    autos = defaultdict(dict)
+    sin_auto = defaultdict(list)
+    for t in build_turnos():
+        cars = {c: [] for c in sorted(conductores_t.get(t, []))}
+        grupos = defaultdict(list)
+        sueltos = []
+        for uid in sorted(pasajeros_t.get(t, [])):
+            c = ultimo_conductor.get(uid)
+            if c in cars and len(cars[c]) < asientos:
+                cars[c].append(uid)
+            elif uid in ultimo_auto:
+                grupos[ultimo_auto[uid]].append(uid)
+            else:
+                sueltos.append(uid)
+
+        # Co-pasajeros anteriores juntos, en el auto con más asientos libres
+        libres = [(len(cars[c]) - asientos, c) for c in cars if len(cars[c]) < asientos]
+        heapq.heapify(libres)
+        for key in sorted(grupos, key=lambda k: (-len(grupos[k]), k)):
+            grupo = grupos[key]
+            if len(grupo) == 1:
+                sueltos.append(grupo[0])
+                continue
+            while grupo and libres:
+                _, c = heapq.heappop(libres)
+                n = asientos - len(cars[c])
+                cars[c].extend(grupo[:n])
+                grupo = grupo[n:]
+                if len(cars[c]) < asientos:
+                    heapq.heappush(libres, (len(cars[c]) - asientos, c))
+            sin_auto[t].extend(grupo)
+
+        rotativo = deque(sorted(c for _, c in libres))
+        for uid in sorted(sueltos):
+            if not rotativo:
+                sin_auto[t].append(uid)
+                continue
+            c = rotativo.popleft()
+            cars[c].append(uid)
+            if len(cars[c]) < asientos:
+                rotativo.append(c)
+
+        for c, grupo in cars.items():
+            for uid in grupo:
+                ultimo_conductor[uid] = c
+                ultimo_auto[uid] = (t, c)
+        if cars:
+            autos[t] = cars
+    return autos, sin_auto
+
+
+def shard_by_group(usuarios: List[dict], conductores: List[dict]) -> Dict[str, Tuple[List[dict], List[dict]]]:
+    """
+    Separa usuarios y conductores por "grupo" (zona de salida). Personas de grupos
+    distintos nunca comparten auto, así que cada grupo es un problema independiente.
+    Se omiten los grupos sin demanda.
+    """
+    shards = defaultdict(lambda: ([], []))
+    for u in usuarios:
+        shards[u.get("grupo", "")][0].append(u)
+    for c in conductores:
+        shards[c.get("grupo", "")][1].append(c)
+    return {
+        g: (us, cs) for g, (us, cs) in shards.items()
+        if any(u["demanda_original"] for u in us)
+    }
+
+
+def solve_shard(usuarios: List[dict], conductores: List[dict]):
+    """
+    Pipeline completo para un grupo: densidad, conductores, pasajeros y autos.
+    Return (y, x, pasajeros, autos, sin_auto, status_densidad, status_conductores),
+    con sin_auto = n° de viajes de pasajeros que quedaron sin auto.
+    """
+    y, s1 = modelo_densidad(usuarios)
+    if s1 != "Optimal":
+        return {}, {}, {}, {}, 0, s1, None
+    x, _, _, s2 = modelo_conductores(conductores, y)
+    if s2 != "Optimal":
+        return y, {}, {}, {}, 0, s1, s2
+    pasajeros = fill_pasajeros(y, x)
+    autos, sin_auto = match_pasajeros(x, pasajeros)
+    return dict(y), dict(x), dict(pasajeros), dict(autos), sum(len(v) for v in sin_auto.values()), s1, s2
+
+
+def optimize_sharded(usuarios: List[dict], conductores: List[dict], workers: Optional[int] = None):
+    """
+    Resuelve cada grupo en su propio proceso y une los resultados para
+    persist_assignments. Con un solo grupo (o workers=1) resuelve en este proceso.
+    Return (y, x, pasajeros, autos, sin_auto, status_densidad, status_conductores); los
+    status son "Optimal" solo si todos los grupos lo son, si no el primer fallo
+    con el grupo entre paréntesis.
+    """
+    shards = shard_by_group(usuarios, conductores)
+    workers = min(len(shards), workers or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {g: pool.submit(solve_shard, us, cs) for g, (us, cs) in shards.items()}
+            results = {g: f.result() for g, f in futures.items()}
+    else:
+        results = {g: solve_shard(us, cs) for g, (us, cs) in shards.items()}
+
+    y, x, pasajeros, autos = {}, {}, {}, {}
+    sin_auto = 0
+    s1 = s2 = "Optimal"
+    for g, (y_g, x_g, p_g, a_g, sin_g, s1_g, s2_g) in sorted(results.items()):
+        if s1_g != "Optimal" and s1 == "Optimal":
+            s1 = f"{s1_g} ({g or 'sin zona'})"
+        if s2_g != "Optimal" and s2 == "Optimal" and s1_g == "Optimal":
+            s2 = f"{s2_g} ({g or 'sin zona'})"
+        # Los ids de usuario son disjuntos entre grupos
+        y.update(y_g)
+        x.update(x_g)
+        pasajeros.update(p_g)
+        sin_auto += sin_g
+        for t, cars in a_g.items():
+            autos.setdefault(t, {}).update(cars)
+    return y, x, pasajeros, autos, sin_auto, s1, s2
@@ -0,0 +1,127 @@
+"""
+Middleware de rendimiento opcional (PERF_MONITOR=1).
+
+Por request registra latencia, número de sentencias SQL y tiempo total en BD
+(vía eventos de SQLAlchemy) y, en una fracción muestreada de requests, el peak
+de memoria asignada con tracemalloc. Los requests lentos se loguean con su
+lista de queries y se mantiene una ventana móvil por endpoint para percentiles.
+"""
+
+import random
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_lock = threading.Lock()
+_window = defaultdict(deque)  # endpoint -> deque[(latency_ms, n_queries, db_ms, peak_kb|None)]
+_installed = False
+# tracemalloc es global al proceso: solo un request muestreado a la vez, y solo
+# si el tracing no lo activó alguien más (p. ej. PYTHONTRACEMALLOC).
+_trace_lock = threading.Lock()
+
+
+def init_app(app):
+    global _installed
+    if not app.config.get("PERF_MONITOR"):
+        return
+    if not _installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _installed = True
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    app.teardown_request(_stop_trace)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "perf_queries" in g:
+        g.perf_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "perf_queries" in g:
+        elapsed = (time.perf_counter() - g.pop("perf_query_start", time.perf_counter())) * 1000
+        g.perf_queries.append((statement, elapsed))
+
+
+def _start_request():
+    g.perf_queries = []
+    g.perf_sampled = False
+    if random.random() < _config("PERF_SAMPLE_RATE") and _trace_lock.acquire(blocking=False):
+        if tracemalloc.is_tracing():
+            _trace_lock.release()
+        else:
+            tracemalloc.start()
+            g.perf_sampled = True
+    g.perf_start = time.perf_counter()
+
+
+def _end_request(response):
+    if "perf_start" not in g:
+        return response
+    latency = (time.perf_counter() - g.perf_start) * 1000
+    queries = g.perf_queries
+    db_ms = sum(ms for _, ms in queries)
+    peak_kb = None
+    if g.perf_sampled:
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        _stop_trace()
+
+    endpoint = request.endpoint or request.path
+    with _lock:
+        window = _window[endpoint]
+        window.append((latency, len(queries), db_ms, peak_kb))
+        while len(window) > _config("PERF_WINDOW"):
+            window.popleft()
+
+    if latency >= _config("PERF_SLOW_MS"):
+        current_app.logger.warning(
+            "Request lento %s %s: %.1f ms, %d queries (%.1f ms en BD)\n%s",
+            request.method, request.path, latency, len(queries), db_ms,
+            "\n".join(f"  {ms:7.1f} ms  {stmt}" for stmt, ms in queries),
+        )
+    return response
+
+
+def _stop_trace(exc=None):
+    # También corre en teardown, por si el request terminó con una excepción
+    if g.pop("perf_sampled", False):
+        tracemalloc.stop()
+        _trace_lock.release()
+
+
+def _config(key):
+    return current_app.config[key]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return round(values[idx], 1)
+
+
+def summary() -> dict:
+    """Percentiles por endpoint sobre la ventana móvil."""
+    with _lock:
+        snapshot = {ep: list(w) for ep, w in _window.items()}
+    out = {}
+    for endpoint, samples in sorted(snapshot.items()):
+        latencies = [s[0] for s in samples]
+        queries = [s[1] for s in samples]
+        db_ms = [s[2] for s in samples]
+        peaks = [s[3] for s in samples if s[3] is not None]
+        out[endpoint] = {
+            "count": len(samples),
+            "latency_ms": {q: _percentile(latencies, p) for q, p in (("p50", .5), ("p95", .95), ("p99", .99))},
+            "queries": {"p50": _percentile(queries, .5), "max": max(queries)},
+            "db_ms": {"p50": _percentile(db_ms, .5), "p95": _percentile(db_ms, .95)},
+            "peak_kb": {"p50": _percentile(peaks, .5), "max": round(max(peaks), 1) if peaks else None},
+        }
+    return out
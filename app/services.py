@@ -1,6 +1,9 @@
 from collections import defaultdict
 from typing import Dict, List, Tuple
-from .models import db, User, Preference, DAYS, IDA_SLOTS, VUELTA_SLOTS
+from sqlalchemy import func
+from .analytics import data_version
+from .api import invalidate_payload
+from .models import db, User, Preference, CarAssignment, Week, DAYS, IDA_SLOTS, VUELTA_SLOTS, normalize_grupo
 
 Turno = Tuple[str, str, str]
 
@@ -40,6 +43,7 @@ def build_usuarios_from_db(week_id: int) -> List[dict]:
                         flex[(d, VUELTA_SLOTS[j], "vuelta")] = 1
         usuarios.append({
             "id": u.id,
+            "grupo": normalize_grupo(u.grupo) or "",
             "demanda_original": demanda,
             "flexibilidad": flex,
         })
@@ -76,12 +80,24 @@ def build_conductores_from_db(week_id: int, usuarios: List[dict]) -> List[dict]:
         p_score = 5.0 + (2.0 if v else 0.0) + 0.5 * days_can_drive
         if days_can_drive < 2:
             p_score -= 1.0
-        conductores.append({"id": u.id, "m": m, "v": v, "p": p_score})
+        conductores.append({"id": u.id, "grupo": normalize_grupo(u.grupo) or "", "m": m, "v": v, "p": p_score})
     return conductores
 
 
-def persist_assignments(week_id: int, y, x, pasajeros):
+def week_watermark(week_id: int) -> str:
+    """
+    Marca de los datos de entrada de una semana: preferencias (n°, última
+    modificación) y usuarios (n°, última modificación; zona y voluntariado
+    también cambian el problema).
+    """
+    prefs = data_version(week_id)
+    users = db.session.query(func.count(User.id), func.max(User.updated_at)).one()
+    return "|".join(str(v) for v in (*prefs, *users))
+
+
+def persist_assignments(week_id: int, y, x, pasajeros, autos=None):
     # Reset roles and assigned slots
+    CarAssignment.query.filter_by(week_id=week_id).delete()
     prefs = Preference.query.filter_by(week_id=week_id).all()
     for p in prefs:
         p.role_ida = None
@@ -127,4 +143,18 @@ def persist_assignments(week_id: int, y, x, pasajeros):
                     pref.role_vuelta = "pasajero"
                 pref.assigned_vuelta_slot = s
 
+    # Apply autos (pasajero -> conductor)
+    for (d, s, tipo), cars in (autos or {}).items():
+        for driver_id, grupo in cars.items():
+            for uid in grupo:
+                db.session.add(CarAssignment(
+                    week_id=week_id, day=d, slot=s, tipo=tipo, driver_id=driver_id, passenger_id=uid,
+                ))
+
+    db.session.commit()
+
+    # La propia persistencia cambia la marca: se guarda la de después del commit
+    week = db.session.get(Week, week_id)
+    week.optimized_version = week_watermark(week_id)
     db.session.commit()
+    invalidate_payload()
@@ -1,6 +1,9 @@
-from app import create_app
+from app import create_app, init_db
 
 app = create_app()
 
 if __name__ == "__main__":
+    # Servidor de desarrollo: asegura el esquema antes de arrancar
+    with app.app_context():
+        init_db()
     app.run(debug=True)
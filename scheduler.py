@@ -1,53 +1,150 @@
 """
-Programador: tarea semanal para optimizar la semana ACTUAL.
+Programador: mantiene optimizada la semana ACTUAL.
 
-- Se debe programar para ejecutarse los sábados.
-- Solo procesa la semana actual (lunes de la fecha de ejecución), no la próxima.
+- Por defecto corre como proceso residente (APScheduler): cada --poll segundos
+  compara la marca de datos de la semana (n° y última modificación de
+  preferencias y usuarios) con la de la última optimización persistida
+  (Week.optimized_version) y, si cambió, re-optimiza una vez que pasan --quiet
+  segundos sin nuevos cambios. Las optimizaciones corren de a una; las zonas
+  de una optimización se resuelven en paralelo (--workers). PuLP se importa
+  una sola vez al arrancar.
+- Con --once mantiene el comportamiento anterior: una corrida que solo
+  optimiza los sábados (para tareas programadas externas).
 """
 
+import argparse
+import time
 from datetime import date, timedelta
 
+from flask import current_app
+
 from app import create_app
 from app.models import get_or_create_week
 from app.services import (
     build_usuarios_from_db,
     build_conductores_from_db,
     persist_assignments,
+    week_watermark,
 )
-from app.optimizers import modelo_densidad, modelo_conductores, fill_pasajeros
+from app.optimizers import optimize_sharded
 
 
-def main():
+def current_monday() -> date:
+    today = date.today()
+    return today - timedelta(days=today.weekday())  # lunes de la semana actual
+
+
+def optimize_week(week, before_persist=None) -> bool:
+    """Corre el pipeline completo para una semana. Requiere app context."""
+    usuarios = build_usuarios_from_db(week.id)
+    total_demanda = sum(len(u.get("demanda_original", {})) for u in usuarios)
+    if total_demanda == 0:
+        print("No hay preferencias para la semana:", week.start_date)
+        return False
+
+    conductores = build_conductores_from_db(week.id, usuarios)
+    y, x, pasajeros, autos, sin_auto, s1, s2 = optimize_sharded(
+        usuarios, conductores, workers=current_app.config["OPTIMIZE_WORKERS"],
+    )
+    print("Modelo1:", s1)
+    print("Modelo2:", s2)
+
+    if s1 == "Optimal" and s2 == "Optimal":
+        if before_persist and not before_persist():
+            print("Los datos cambiaron durante la optimización; no se persiste.")
+            return False
+        persist_assignments(week.id, y, x, pasajeros, autos)
+        if sin_auto:
+            print("Pasajeros sin auto:", sin_auto)
+        print("OK: optimización realizada para la semana:", week.start_date)
+        return True
+    print("Optimización no óptima; no se persiste.")
+    return False
+
+
+class Watcher:
+    """
+    Estado de la semana actual: última marca vista, momento del último cambio
+    (para el debounce) y marca de la última corrida fallida (para no repetirla).
+    La marca ya optimizada vive en Week.optimized_version, así que sobrevive a
+    reinicios del proceso.
+    """
+
+    def __init__(self, app, quiet: float):
+        self.app = app
+        self.quiet = quiet
+        self.seen = {}        # week_id -> marca vista en el último poll
+        self.changed_at = {}  # week_id -> time.monotonic() del último cambio
+        self.failed = {}      # week_id -> marca con la que falló la última corrida
+
+    def poll(self):
+        # Corre en el job de APScheduler (max_instances=1): las optimizaciones
+        # quedan serializadas.
+        with self.app.app_context():
+            week = get_or_create_week(current_monday())
+            mark = week_watermark(week.id)
+            now = time.monotonic()
+            if mark != self.seen.get(week.id):
+                self.seen[week.id] = mark
+                self.changed_at[week.id] = now
+            if mark in (week.optimized_version, self.failed.get(week.id)):
+                return
+            if now - self.changed_at[week.id] < self.quiet:
+                return
+            try:
+                ok = optimize_week(week, before_persist=lambda: week_watermark(week.id) == mark)
+            except Exception as e:  # noqa: BLE001 - el daemon no debe morir por una corrida
+                print("Error optimizando semana", week.start_date, e)
+                ok = False
+            # Si falló con los mismos datos, no se reintenta hasta que cambien
+            if not ok and week_watermark(week.id) == mark:
+                self.failed[week.id] = mark
+
+
+def create_scheduler_app(workers: int):
+    app = create_app()
+    # Este proceso sí puede resolver zonas en paralelo (el worker web no)
+    app.config["OPTIMIZE_WORKERS"] = workers
+    return app
+
+
+def run_once(workers: int):
     # Ejecutar solo los sábados para evitar rehacer cálculos en la semana.
     today = date.today()
     if today.weekday() != 5:  # 5 = sábado
         print(f"Omitido: {today} no es sábado; el scheduler corre solo los sábados.")
         return
 
-    app = create_app()
+    app = create_scheduler_app(workers)
     with app.app_context():
-        monday = today - timedelta(days=today.weekday())  # lunes de la semana actual
-        week = get_or_create_week(monday)
-
-        usuarios = build_usuarios_from_db(week.id)
-        total_demanda = sum(len(u.get("demanda_original", {})) for u in usuarios)
-        if total_demanda == 0:
-            print("No hay preferencias para la semana actual:", monday)
-            return
-
-        y, s1 = modelo_densidad(usuarios)
-        print("Modelo1:", s1)
-
-        conductores = build_conductores_from_db(week.id, usuarios)
-        x, N_t, D_t, s2 = modelo_conductores(conductores, y)
-        print("Modelo2:", s2)
-
-        if s1 == "Optimal" and s2 == "Optimal":
-            pasajeros = fill_pasajeros(y, x)
-            persist_assignments(week.id, y, x, pasajeros)
-            print("OK: optimización realizada para la semana actual:", monday)
-        else:
-            print("Optimización no óptima; no se persiste.")
+        optimize_week(get_or_create_week(current_monday()))
+
+
+def run_daemon(poll: float, quiet: float, workers: int):
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    app = create_scheduler_app(workers)
+    watcher = Watcher(app, quiet=quiet)
+    scheduler = BlockingScheduler()
+    scheduler.add_job(watcher.poll, "interval", seconds=poll, max_instances=1, coalesce=True)
+    print(f"Scheduler activo: poll={poll}s, quiet={quiet}s, workers={workers}")
+    watcher.poll()
+    scheduler.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimización de la semana actual")
+    parser.add_argument("--once", action="store_true", help="una corrida (solo sábados) y salir")
+    parser.add_argument("--poll", type=float, default=30.0, help="segundos entre revisiones de cambios")
+    parser.add_argument("--quiet", type=float, default=120.0, help="segundos sin cambios antes de re-optimizar")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="procesos para resolver zonas en paralelo (0 = uno por CPU)")
+    args = parser.parse_args()
+
+    if args.once:
+        run_once(args.workers)
+    else:
+        run_daemon(args.poll, args.quiet, args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+"""
+Mide el costo de arranque de un worker web (`import wsgi`) con `python -X importtime`.
+
+Uso:
+    python scripts/bench_startup.py [--runs 5] [--max-ms 800] [--top 15]
+
+Falla (exit 1) si el worker importa PuLP o si la mediana supera --max-ms.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORBIDDEN = ("pulp",)
+
+
+def run_once():
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import wsgi"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(proc.stderr)
+    # Formato: "import time: self [us] | cumulative | imported package"
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative, name = line.split(":", 1)[1].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative))
+    total_us = modules.get("wsgi", (0, 0))[1]
+    return total_us, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    totals = []
+    modules = {}
+    for _ in range(args.runs):
+        total_us, modules = run_once()
+        totals.append(total_us / 1000)
+
+    median = statistics.median(totals)
+    print(f"import wsgi: mediana {median:.1f} ms (min {min(totals):.1f}, max {max(totals):.1f}, n={args.runs})")
+    print(f"Top {args.top} imports (acumulado, última corrida):")
+    top_level = {n: v for n, v in modules.items() if "." not in n}
+    for name, (_, cumulative) in sorted(top_level.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    for name in FORBIDDEN:
+        if name in modules:
+            print(f"ERROR: el worker web importa '{name}' al arrancar")
+            failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"ERROR: mediana {median:.1f} ms supera el límite de {args.max_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()